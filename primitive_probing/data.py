@@ -1,8 +1,11 @@
 import os
 import pickle
+import tempfile
 
+import numpy as np
 import torch
 from torch.utils.data import Dataset, DataLoader
+from torch.utils.data.dataloader import default_collate
 import pytorch_lightning as pl
 
 
@@ -17,34 +20,124 @@ class THOREmbeddingsDataset(Dataset):
                 assert embedding_type in ['imagenet_avgpool', 'clip_avgpool']
                 if embedding_type == 'imagenet_avgpool': embedding_type = 'imagenet_conv'
                 elif embedding_type == 'clip_avgpool': embedding_type = 'clip_conv'
+            thor_file = os.path.join(data_dir, f"thor_{split}.pt")
+            # name -> (cache file, source files it is built from, on-disk dtype or None to keep it).
+            # Binary labels fit in uint8; free_space is an unbounded step count, so it stays int64
+            caches = {
+                'embeddings': (f"thor_{split}_{embedding_type}.npy", [thor_file], None),
+                'predictions': (
+                    f"thor_{split}_{prediction_type}.npy", [thor_file],
+                    np.int64 if prediction_type == 'free_space' else np.uint8
+                )
+            }
 
+        elif prediction_type == 'reachability':
+            features_file = os.path.join(data_dir, f"reachable_image_features.pt")
+            metadata_file = os.path.join(data_dir, f"reachable_{split}.pkl")
+            # objects index the 110 reachability classes, reachable is a binary label. image_idx
+            # stays int64, since a uint8 index tensor would be read as a boolean mask
+            caches = {
+                'embeddings': (f"reachable_image_features_{embedding_type}.npy", [features_file], None),
+                'image_idx': (f"reachable_{split}_image_idx.npy", [features_file, metadata_file], np.int64),
+                'objects': (f"reachable_{split}_objects.npy", [metadata_file], np.uint8),
+                'reachable': (f"reachable_{split}_reachable.npy", [metadata_file], np.uint8)
+            }
+
+        # the stacked arrays are cached as .npy files and memory-mapped, so
+        # DataLoader workers share the same file-backed pages instead of each
+        # holding a copy of the features. Embeddings are keyed only on their
+        # source and embedding type, so all tasks (and, for reachability,
+        # all splits) reading the same features share one file.
+        cache_dir = os.path.join(data_dir, 'cache')
+        cache_files = {name: os.path.join(cache_dir, c) for name, (c, _, _) in caches.items()}
+
+        stale = [
+            name for name, (_, source_files, _) in caches.items()
+            if not os.path.exists(cache_files[name]) or any(
+                os.path.getmtime(cache_files[name]) < os.path.getmtime(f) for f in source_files
+            )
+        ]
+        if len(stale) > 0:
+            os.makedirs(cache_dir, exist_ok=True)
+            arrays = self.stack_features(data_dir, split, embedding_type, prediction_type)
+            for name in stale:
+                array = arrays[name].numpy()
+                # targets are stored in a fixed compact dtype per array, so every split of a
+                # task has the same on-disk type; LinearEncoder widens them on the device
+                dtype = caches[name][2]
+                if dtype is not None:
+                    if not np.array_equal(array.astype(dtype), array):
+                        raise ValueError(f"{name} values for {prediction_type}/{split} do not fit in {np.dtype(dtype)}")
+                    array = array.astype(dtype)
+                # every process writes its own temp file, so concurrent builds (DDP ranks,
+                # tasks sharing an embeddings file) never rename each other's output away
+                with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as f:
+                    np.save(f, array)
+                os.replace(f.name, cache_files[name])
+
+        # copy-on-write mapping, so the tensors are writable but pages stay shared
+        arrays = {name: torch.from_numpy(np.load(c, mmap_mode='c')) for name, c in cache_files.items()}
+        self.embeddings = arrays['embeddings']
+        if prediction_type == 'reachability':
+            # each image is paired with several objects, so its features are stored once
+            # and samples point at them through image_idx
+            self.image_idx = arrays['image_idx']
+            self.predictions = (arrays['objects'], arrays['reachable'])
+        else:
+            self.image_idx = None
+            self.predictions = arrays['predictions']
+
+    @staticmethod
+    def stack_features(data_dir, split, embedding_type, prediction_type):
+        if prediction_type in ['object_presence', 'object_localization', 'free_space']:
             data = torch.load(os.path.join(data_dir, f"thor_{split}.pt"))
 
-            self.embeddings = []
-            self.predictions = []
+            embeddings = []
+            predictions = []
             for scene_name, frames in data.items():
                 for frame_features in frames:
-                    self.embeddings.append(frame_features[embedding_type])
-                    self.predictions.append(frame_features[prediction_type])
+                    embeddings.append(frame_features[embedding_type])
+                    predictions.append(frame_features[prediction_type])
+
+            return {
+                'embeddings': torch.stack(embeddings),
+                'predictions': torch.stack([torch.as_tensor(p) for p in predictions])
+            }
 
         elif prediction_type == 'reachability':
             image_features = torch.load(os.path.join(data_dir, f"reachable_image_features.pt"))
-            data = pickle.load(open(os.path.join(data_dir, f"reachable_{split}.pkl"), 'rb'))
-            self.embeddings = []
-            self.predictions = []
-
-            for image, obj, reachable in data:
-                self.embeddings.append(image_features[image][embedding_type])
-                self.predictions.append((
-                    obj,
-                    torch.tensor(reachable, dtype=int)
-                ))
+            with open(os.path.join(data_dir, f"reachable_{split}.pkl"), 'rb') as f:
+                data = pickle.load(f)
+            images = sorted(image_features.keys())
+            image_idx = {image: i for i, image in enumerate(images)}
+            return {
+                'embeddings': torch.stack([image_features[image][embedding_type] for image in images]),
+                'image_idx': torch.tensor([image_idx[image] for image, _, _ in data]),
+                'objects': torch.tensor([obj for _, obj, _ in data]),
+                'reachable': torch.tensor([reachable for _, _, reachable in data], dtype=int)
+            }
 
     def __getitem__(self, index):
+        # index may be a single sample or a whole batch of indices (see __getitems__)
+        if self.image_idx is not None:
+            return self.embeddings[self.image_idx[index]], tuple(p[index] for p in self.predictions)
         return self.embeddings[index], self.predictions[index]
 
+    def __getitems__(self, indices):
+        # DataLoader (torch >= 2.0) fetches a whole batch through this, so each batch is a
+        # single gather from the stacked tensors; collate_batch passes it through as is
+        return self[indices]
+
     def __len__(self):
-        return len(self.embeddings)
+        return len(self.predictions[0] if isinstance(self.predictions, tuple) else self.predictions)
+
+
+def collate_batch(batch):
+    # batches from __getitems__ are already stacked, older torch fetches (and we collate)
+    # one sample at a time
+    if isinstance(batch, list):
+        return default_collate(batch)
+    return batch
 
 
 class THOREmbeddingsDataModule(pl.LightningDataModule):
@@ -67,20 +160,30 @@ class THOREmbeddingsDataModule(pl.LightningDataModule):
             self.hparams.embedding_type, self.hparams.prediction_type
         )
 
-    def train_dataloader(self):
+    def _dataloader(self, dataset, shuffle, num_workers):
+        # keep workers alive across epochs; prefetch_factor is only accepted with workers
+        worker_kwargs = dict(persistent_workers=True, prefetch_factor=4) if num_workers > 0 else {}
         return DataLoader(
-            self.train_dataset, batch_size=self.hparams.batch_size, shuffle=True,
+            dataset, batch_size=self.hparams.batch_size, shuffle=shuffle,
+            collate_fn=collate_batch,
+            num_workers=num_workers, pin_memory=torch.cuda.is_available(),
+            **worker_kwargs
+        )
+
+    def train_dataloader(self):
+        return self._dataloader(
+            self.train_dataset, shuffle=True,
             num_workers=int(0.8 * self.hparams.num_workers)
         )
 
     def val_dataloader(self):
-        return DataLoader(
-            self.val_dataset, batch_size=self.hparams.batch_size, shuffle=False,
+        return self._dataloader(
+            self.val_dataset, shuffle=False,
             num_workers=int(0.2 * self.hparams.num_workers)
         )
 
     def test_dataloader(self):
-        return DataLoader(
-            self.test_dataset, batch_size=self.hparams.batch_size, shuffle=False,
+        return self._dataloader(
+            self.test_dataset, shuffle=False,
             num_workers=int(self.hparams.num_workers)
         )
@@ -70,6 +70,11 @@ clip_avgpool = nn.Sequential(
 clip_model.attnpool = nn.Identity()
 clip_avgpool = freeze_model(clip_avgpool)
 
+# both encoders are frozen, so don't track gradients through feature extraction
+torch.set_grad_enabled(False)
+# inputs are always 224x224 crops, so let cuDNN pick the fastest conv algorithms once
+torch.backends.cudnn.benchmark = True
+
 ### Image Processing
 
 image_features = {}
@@ -65,7 +65,5 @@ for split in ['train', 'val', 'test']:
             data_all.append(j)
     random.shuffle(data_all)
 
-    pickle.dump(
-        data_all,
-        open(os.path.join(args.output_dir, f"reachable_{split}.pkl"), 'wb')
-    )
+    with open(os.path.join(args.output_dir, f"reachable_{split}.pkl"), 'wb') as f:
+        pickle.dump(data_all, f, protocol=pickle.HIGHEST_PROTOCOL)
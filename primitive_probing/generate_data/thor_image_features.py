@@ -67,12 +67,19 @@ clip_avgpool = nn.Sequential(
 clip_model.attnpool = nn.Identity()
 clip_avgpool = freeze_model(clip_avgpool)
 
+# both encoders are frozen, so don't track gradients through feature extraction
+torch.set_grad_enabled(False)
+# inputs are always 224x224 crops, so let cuDNN pick the fastest conv algorithms once
+torch.backends.cudnn.benchmark = True
 
-def class_mask(semantic_frame, class_color):
-    if class_color is None:
-        return np.zeros(semantic_frame.shape[:2], dtype=bool)
-    mask = np.all(semantic_frame == class_color, axis=-1)
-    return mask
+
+rgb_weights = np.array([1 << 16, 1 << 8, 1], dtype=np.int64)
+
+def class_masks(semantic_frame, class_colors):
+    # pack each RGB pixel into one integer, so all classes are matched in a single comparison
+    frame_ids = semantic_frame.astype(np.int64) @ rgb_weights
+    class_ids = np.array([-1 if c is None else np.dot(c, rgb_weights) for c in class_colors], dtype=np.int64)
+    return frame_ids[None] == class_ids[:, None, None]
 
 def obj_presence(class_masks):
     return class_masks.sum(axis=(1,2)) > 0
@@ -112,16 +119,14 @@ for split in ['train', 'val', 'test']:
             clip_features_attnpool = clip_pool(clip_features).float()[0].cpu()
             clip_features_avgpool = clip_avgpool(clip_features.float())[0].cpu()
 
-            class_masks = np.array([
-                class_mask(
-                    point['semantic_frame'],
-                    point['object_id_to_color'].get(o, None)
-                ) for o in target_objects
-            ])
+            masks = class_masks(
+                point['semantic_frame'],
+                [point['object_id_to_color'].get(o, None) for o in target_objects]
+            )
 
-            object_presence = torch.tensor(obj_presence(class_masks), dtype=int, device=torch.device('cpu'))
+            object_presence = torch.tensor(obj_presence(masks), dtype=int, device=torch.device('cpu'))
             object_presence_grid = torch.tensor(
-                [obj_presence(class_masks[:, y1:y2, x1:x2]) for (y1, y2, x1, x2) in grid_bboxes(class_masks.shape[1:3], (3, 3))],
+                [obj_presence(masks[:, y1:y2, x1:x2]) for (y1, y2, x1, x2) in grid_bboxes(masks.shape[1:3], (3, 3))],
                 dtype=int,
                 device=torch.device('cpu')
             )
@@ -0,0 +1,96 @@
+import os
+import sys
+import pickle
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, DistributedSampler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from data import THOREmbeddingsDataModule, collate_batch
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    frames = [{
+        'clip_avgpool': torch.randn(2048),
+        'clip_conv': torch.randn(2048, 7, 7),
+        'object_presence': torch.randint(0, 2, (52,)),
+        'object_localization': torch.randint(0, 2, (9, 52)),
+        'free_space': i
+    } for i in range(10)]
+    image_features = {f"image_{i}": {'clip_avgpool': torch.randn(2048)} for i in range(4)}
+    reachable = [(f"image_{i % 4}", i % 7, i % 2 == 0) for i in range(10)]
+
+    for split in ['train', 'val', 'test']:
+        torch.save({'FloorPlan1': frames}, tmp_path / f"thor_{split}.pt")
+        with open(tmp_path / f"reachable_{split}.pkl", 'wb') as f:
+            pickle.dump(reachable, f)
+    torch.save(image_features, tmp_path / "reachable_image_features.pt")
+    return str(tmp_path)
+
+
+def replace_sampler(loader, sampler):
+    # what Lightning does to each dataloader under DDP
+    try:
+        from pytorch_lightning.utilities.data import _update_dataloader
+    except ImportError:
+        return DataLoader(
+            loader.dataset, batch_size=loader.batch_size, sampler=sampler,
+            collate_fn=loader.collate_fn
+        )
+    return _update_dataloader(loader, sampler)
+
+
+@pytest.mark.parametrize('prediction_type', ['object_presence', 'object_localization', 'reachability', 'free_space'])
+def test_batches_survive_ddp_sampler_replacement(data_dir, prediction_type):
+    dm = THOREmbeddingsDataModule(data_dir, 'clip_avgpool', prediction_type, batch_size=3)
+    dm.setup()
+    loader = dm.train_dataloader()
+    loader = replace_sampler(loader, DistributedSampler(loader.dataset, num_replicas=2, rank=0))
+
+    batches = list(loader)
+    assert [len(x) for x, _ in batches] == [3, 2]
+    for x, y in batches:
+        for target in (y if prediction_type == 'reachability' else (y,)):
+            assert len(target) == len(x)
+
+
+def test_collate_batch_matches_batched_fetch(data_dir):
+    dm = THOREmbeddingsDataModule(data_dir, 'clip_avgpool', 'reachability')
+    dm.setup()
+    dataset = dm.train_dataset
+
+    x, (objects, reachable) = collate_batch([dataset[0], dataset[1]])
+    x_batched, (objects_batched, reachable_batched) = dataset.__getitems__([0, 1])
+    assert torch.equal(x, x_batched)
+    assert torch.equal(objects, objects_batched)
+    assert torch.equal(reachable, reachable_batched)
+
+
+def test_concurrent_cache_builds_do_not_collide(data_dir):
+    from concurrent.futures import ThreadPoolExecutor
+    from data import THOREmbeddingsDataset
+
+    # object_presence and free_space share the thor_{split}_{embedding}.npy cache
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        datasets = list(pool.map(
+            lambda prediction_type: THOREmbeddingsDataset(data_dir, 'train', 'clip_avgpool', prediction_type),
+            ['object_presence', 'free_space'] * 2
+        ))
+
+    assert all(torch.equal(d.embeddings, datasets[0].embeddings) for d in datasets)
+    assert not [f for f in os.listdir(os.path.join(data_dir, 'cache')) if f.endswith('.tmp')]
+
+
+@pytest.mark.parametrize('prediction_type, dtypes', [
+    ('object_presence', [torch.uint8]),
+    ('free_space', [torch.int64]),
+    ('reachability', [torch.uint8, torch.uint8])
+])
+def test_target_dtypes_are_fixed_per_task(data_dir, prediction_type, dtypes):
+    dm = THOREmbeddingsDataModule(data_dir, 'clip_avgpool', prediction_type)
+    dm.setup()
+    for dataset in [dm.train_dataset, dm.val_dataset, dm.test_dataset]:
+        predictions = dataset.predictions if prediction_type == 'reachability' else (dataset.predictions,)
+        assert [p.dtype for p in predictions] == dtypes
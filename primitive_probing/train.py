@@ -35,8 +35,7 @@ class LinearEncoder(pl.LightningModule):
                 act_fn = nn.Softmax(dim=1)
 
             self.model = nn.Sequential(
-                nn.Linear(input_dim, output_dim),
-                act_fn
+                nn.Linear(input_dim, output_dim)
             )
 
         elif prediction_type == 'object_localization':
@@ -44,36 +43,42 @@ class LinearEncoder(pl.LightningModule):
             self.model = nn.Sequential(
                 nn.AdaptiveAvgPool2d(output_size=(3,3)),
                 nn.Conv2d(2048, len(target_objects), kernel_size=1),
-                nn.Flatten(start_dim=2),
-                nn.Sigmoid()
+                nn.Flatten(start_dim=2)
             )
+            act_fn = nn.Sigmoid()
 
         else: raise NotImplementedError()
 
+        # self.model outputs logits; act_fn is applied in forward() and for metrics
+        self.act_fn = act_fn
+
     def forward(self, x):
-        return self.model(x)
+        return self.act_fn(self.model(x))
 
     def compute_loss(self, batch, eval=False):
         x, y = batch
 
+        # integer targets are stored compactly, widen them once they're on the device
+        if self.hparams.prediction_type == 'reachability':
+            obj_idx, y = y
+            obj_idx = obj_idx.long()
+        y = y.long()
+
         if self.hparams.prediction_type == 'object_localization':
             y = y.flatten(start_dim=1)
-        elif self.hparams.prediction_type == 'reachability':
-            obj_idx, y = y
-            obj_idx = obj_idx.tolist()
         elif self.hparams.prediction_type == 'free_space':
-            y[y > max_forward_steps] = max_forward_steps
+            y = y.clamp(max=max_forward_steps)
 
-        y_pred = self.forward(x)
+        y_pred = self.model(x)
 
         if self.hparams.prediction_type == 'object_localization':
             y_pred = y_pred.permute(0, 2, 1).flatten(start_dim=1)
         elif self.hparams.prediction_type == 'reachability':
-            y_pred = y_pred[range(len(obj_idx)), obj_idx]
+            y_pred = y_pred.gather(1, obj_idx.view(-1, 1)).squeeze(1)
 
         # compute loss
         if self.hparams.prediction_type in ['object_presence', 'object_localization', 'reachability']:
-            loss = F.binary_cross_entropy(y_pred, y.float())
+            loss = F.binary_cross_entropy_with_logits(y_pred, y.float())
         elif self.hparams.prediction_type == 'free_space':
             loss = F.cross_entropy(y_pred, y)
 
@@ -81,6 +86,7 @@ class LinearEncoder(pl.LightningModule):
             return loss
 
         # compute metrics
+        y_pred = self.act_fn(y_pred)
         metrics = {}
         if self.hparams.prediction_type in ['object_presence', 'object_localization']:
             metrics['accuracy'] = MF.f1(y_pred, y)
@@ -115,6 +121,7 @@ class LinearEncoder(pl.LightningModule):
 
 if __name__ == '__main__':
     pl.seed_everything(1)
+    torch.backends.cudnn.benchmark = True
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--data-dir', type=str, dest='data_dir',